@@ -91,6 +91,12 @@ class PluginConfig(ConfigNode):
     skip_source: bool
     disable_gids: list[str]
     disable_uids: list[str]
+    coord_db_path: str
+    coord_lease_ttl: float
+    group_hourly_cap: int
+    group_daily_cap: int
+    friend_hourly_cap: int
+    friend_daily_cap: int
 
     def __init__(self, cfg: AstrBotConfig, context: Context | None = None):
         super().__init__(cfg)
@@ -124,3 +130,17 @@ class PluginConfig(ConfigNode):
             disabled.append(target_id)
             self.save_config()
             return True
+
+    def apply_disable_changes(self, changes: list[tuple[str, str, bool]]) -> None:
+        """应用协调后端同步来的禁用名单变更，仅在有实际变化时保存一次"""
+        changed = False
+        for t, target_id, disabled in changes:
+            ids = self.disabled_list(t == "group")
+            if disabled and target_id not in ids:
+                ids.append(target_id)
+                changed = True
+            elif not disabled and target_id in ids:
+                ids.remove(target_id)
+                changed = True
+        if changed:
+            self.save_config()
@@ -0,0 +1,167 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from astrbot.core import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 无 fcntl，退化为仅依赖 SQLite 自身的锁
+    fcntl = None
+
+LEASE_NAME = "broadcast"
+
+
+class Coordinator:
+    """
+    多实例协调后端：共享卷上的 SQLite(WAL) + 本地文件锁
+
+    - 集群级广播租约：同一时刻只有一个实例持有，持有者需定期心跳续约
+    - 带版本号的禁用名单：每次变更递增版本，各实例按版本增量拉取
+
+    方法均为阻塞调用，在事件循环中应通过 asyncio.to_thread 调用
+    """
+
+    def __init__(self, db_path: str, lease_ttl: float = 30.0):
+        self.db_path = db_path
+        self.lease_ttl = lease_ttl
+        self.node_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.version = 0
+
+        dirname = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(dirname, exist_ok=True)
+        self._lock_path = f"{db_path}.lock"
+
+        self._mutex = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, timeout=10, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._write():
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS lease ("
+                "name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS disable_list ("
+                "target_type TEXT NOT NULL, target_id TEXT NOT NULL, "
+                "disabled INTEGER NOT NULL, version INTEGER NOT NULL, "
+                "PRIMARY KEY (target_type, target_id))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_disable_version "
+                "ON disable_list (version)"
+            )
+
+    @contextmanager
+    def _write(self):
+        """写操作：线程锁 + 文件锁 + IMMEDIATE 事务，跨线程/进程串行化"""
+        with self._mutex, open(self._lock_path, "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    yield
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._conn.execute("COMMIT")
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        with self._mutex:
+            self._conn.close()
+
+    # =========================
+    # 广播租约
+    # =========================
+
+    def acquire_lease(self) -> bool:
+        """尝试获取广播租约，已被其他实例持有且未过期时返回 False"""
+        now = time.time()
+        with self._write():
+            row = self._conn.execute(
+                "SELECT owner, expires_at FROM lease WHERE name = ?", (LEASE_NAME,)
+            ).fetchone()
+            if row and row[0] != self.node_id and row[1] > now:
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO lease (name, owner, expires_at) VALUES (?, ?, ?)",
+                (LEASE_NAME, self.node_id, now + self.lease_ttl),
+            )
+        return True
+
+    def heartbeat(self) -> bool:
+        """续约，租约已丢失时返回 False"""
+        with self._write():
+            cur = self._conn.execute(
+                "UPDATE lease SET expires_at = ? WHERE name = ? AND owner = ?",
+                (time.time() + self.lease_ttl, LEASE_NAME, self.node_id),
+            )
+        return cur.rowcount > 0
+
+    def release_lease(self) -> None:
+        with self._write():
+            self._conn.execute(
+                "DELETE FROM lease WHERE name = ? AND owner = ?",
+                (LEASE_NAME, self.node_id),
+            )
+
+    # =========================
+    # 禁用名单
+    # =========================
+
+    def _next_version(self) -> int:
+        row = self._conn.execute("SELECT MAX(version) FROM disable_list").fetchone()
+        return (row[0] or 0) + 1
+
+    def set_disabled(self, t: str, id_: str, disabled: bool) -> None:
+        with self._write():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO disable_list "
+                "(target_type, target_id, disabled, version) VALUES (?, ?, ?, ?)",
+                (t, id_, int(disabled), self._next_version()),
+            )
+
+    def seed(self, t: str, ids: list[str]) -> None:
+        """
+        首次同步：把共享库中没有记录的本地禁用项作为新版本发布，
+        已有记录的以共享库为准（随后 poll 会把本地名单校正为共享状态）
+        """
+        with self._write():
+            known = {
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT target_id FROM disable_list WHERE target_type = ?", (t,)
+                )
+            }
+            extras = [id_ for id_ in ids if id_ not in known]
+            if not extras:
+                return
+            version = self._next_version()
+            self._conn.executemany(
+                "INSERT INTO disable_list "
+                "(target_type, target_id, disabled, version) VALUES (?, ?, 1, ?)",
+                [(t, id_, version) for id_ in extras],
+            )
+
+    def poll(self) -> list[tuple[str, str, bool]]:
+        """拉取本实例上次同步之后的变更 [(target_type, target_id, disabled)]"""
+        with self._mutex:
+            rows = self._conn.execute(
+                "SELECT target_type, target_id, disabled, version FROM disable_list "
+                "WHERE version > ? ORDER BY version",
+                (self.version,),
+            ).fetchall()
+        if not rows:
+            return []
+        self.version = rows[-1][3]
+        logger.debug(f"[coordinator] 同步到禁用名单版本 {self.version}")
+        return [(t, id_, bool(disabled)) for t, id_, disabled, _ in rows]
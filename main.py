@@ -1,7 +1,12 @@
 import asyncio
+from contextlib import suppress
+from dataclasses import asdict
 
-from astrbot.api.event import filter
-from astrbot.api.star import Context, Star
+from aiocqhttp import CQHttp
+
+from astrbot.api import logger
+from astrbot.api.event import MessageChain, filter
+from astrbot.api.star import Context, Star, StarTools
 from astrbot.core.config.astrbot_config import AstrBotConfig
 from astrbot.core.message.components import Plain, Reply
 from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
@@ -9,7 +14,10 @@ from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
 )
 
 from .config import PluginConfig
+from .coordinator import Coordinator
+from .quota import PendingJobStore, QuotaLedger
 from .utils import (
+    BroadcastResult,
     broadcast,
     get_friend_by_index,
     get_group_by_index,
@@ -25,6 +33,237 @@ class BroadcastPlugin(Star):
         super().__init__(context)
         self.cfg = PluginConfig(config)
         self._broadcast_task = None
+        self._terminating = False
+        # 待广播的消息批次（按发送者区分，保持加入顺序）
+        self._pending_batches: dict[str, list[str | int]] = {}
+        # 账号发送配额账本
+        data_dir = StarTools.get_data_dir("astrbot_plugin_broadcast")
+        self.ledger = QuotaLedger(
+            str(data_dir / "quota_ledger.json"),
+            caps={
+                "group": (self.cfg.group_hourly_cap or 0, self.cfg.group_daily_cap or 0),
+                "friend": (
+                    self.cfg.friend_hourly_cap or 0,
+                    self.cfg.friend_daily_cap or 0,
+                ),
+            },
+        )
+        self.pending_store = PendingJobStore(str(data_dir / "pending_job.json"))
+        # 多实例协调（可选，在 initialize 中建立）
+        self.coord: Coordinator | None = None
+
+    def _setup_coordinator(self) -> Coordinator:
+        coord = Coordinator(
+            self.cfg.coord_db_path, lease_ttl=self.cfg.coord_lease_ttl or 30.0
+        )
+        coord.seed("group", list(self.cfg.disable_gids))
+        coord.seed("friend", list(self.cfg.disable_uids))
+        return coord
+
+    async def _sync_disable(self):
+        """增量拉取其他实例的禁用名单变更"""
+        if self.coord:
+            self.cfg.apply_disable_changes(await asyncio.to_thread(self.coord.poll))
+
+    async def _publish_disable(self, is_group: bool, target_id: str, disabled: bool):
+        if self.coord:
+            await asyncio.to_thread(
+                self.coord.set_disabled,
+                "group" if is_group else "friend",
+                target_id,
+                disabled,
+            )
+
+    async def _release_lease(self):
+        if not self.coord:
+            return
+        try:
+            await asyncio.to_thread(self.coord.release_lease)
+        except Exception as e:
+            logger.error(f"释放广播租约失败: {e}")
+
+    async def _run_with_lease(self, make_coro):
+        """持有集群广播租约执行广播，期间定期心跳续约，租约丢失时取消广播，结束后释放"""
+        assert self.coord
+        job = asyncio.current_task()
+        # 本实例已持有时为续约；被其他实例持有时等待其释放或过期
+        while not await asyncio.to_thread(self.coord.acquire_lease):
+            await asyncio.sleep(self.coord.lease_ttl)
+        loop = asyncio.get_running_loop()
+        last_renewed = loop.time()
+
+        async def _heartbeat():
+            nonlocal last_renewed
+            while True:
+                await asyncio.sleep(self.coord.lease_ttl / 3)
+                try:
+                    alive = await asyncio.to_thread(self.coord.heartbeat)
+                except Exception as e:
+                    # 持续续约失败超过有效期，租约必然已过期，其他实例可能已接管
+                    if loop.time() - last_renewed >= self.coord.lease_ttl:
+                        logger.warning(f"广播租约续约持续失败，取消广播: {e}")
+                        if job:
+                            job.cancel()
+                        return
+                    logger.warning(f"广播租约续约失败，稍后重试: {e}")
+                    continue
+                if alive:
+                    last_renewed = loop.time()
+                else:
+                    logger.warning("广播租约已丢失，取消广播")
+                    if job:
+                        job.cancel()
+                    return
+
+        hb = asyncio.create_task(_heartbeat())
+        try:
+            return await make_coro()
+        finally:
+            hb.cancel()
+            await self._release_lease()
+
+    async def _notify(self, job: dict, text: str):
+        try:
+            await self.context.send_message(job["umo"], MessageChain().message(text))
+        except Exception as e:
+            logger.error(f"广播通知发送失败: {e}")
+
+    async def _run_job(
+        self,
+        client: CQHttp,
+        job: dict,
+        result: BroadcastResult,
+    ) -> BroadcastResult:
+        """
+        按配额分段执行广播任务，每处理完一个目标即把账本与剩余目标落盘。
+        超出配额时顺延到下一个窗口，等待期间释放集群租约；取消时返回已有结果，
+        关闭插件或进程崩溃时保留未完成部分以便重启后恢复
+        """
+        message_ids = job["message_ids"]
+        quota_key = job["quota_key"]
+        scope_text = "群聊" if job["is_group"] else "好友"
+        need = len(message_ids)
+
+        def _persist(_=None):
+            self.ledger.save()
+            self.pending_store.save({**job, "result": asdict(result)})
+
+        def _chunk():
+            return broadcast(
+                client=client,
+                is_group=job["is_group"],
+                message_ids=message_ids,
+                ids=result.pending_ids,
+                delay=self.cfg.get_broadcast_delay(),
+                ledger=self.ledger,
+                quota_key=quota_key,
+                result=result,
+                on_progress=_persist,
+            )
+
+        try:
+            while result.pending_ids and not result.cancelled:
+                # 配额上限可能在顺延期间被调低（如恢复的任务），批次不再放得下时直接结束
+                max_batch = self.ledger.max_batch(quota_key)
+                if need > max_batch:
+                    await self._notify(
+                        job,
+                        f"批次共{need}条消息，超过当前{scope_text}发送配额上限{max_batch}条，"
+                        f"剩余{len(result.pending_ids)}个{scope_text}不再广播",
+                    )
+                    break
+
+                if self.ledger.remaining(quota_key) < need:
+                    _persist()
+                    wait = max(self.ledger.retry_after(quota_key, need), 1.0)
+                    await self._notify(
+                        job,
+                        f"发送配额已用尽，剩余{len(result.pending_ids)}个{scope_text}"
+                        f"将在约{int(wait // 60) + 1}分钟后继续广播",
+                    )
+                    await asyncio.sleep(wait)
+                    continue
+
+                # 等待期间可能有人关闭了广播（含其他实例同步来的变更）
+                await self._sync_disable()
+                result.pending_ids = self.cfg.filter_broadcastable(
+                    result.pending_ids, is_group=job["is_group"]
+                )
+                if not result.pending_ids:
+                    break
+                _persist()
+
+                if self.coord:
+                    await self._run_with_lease(_chunk)
+                else:
+                    await _chunk()
+        except asyncio.CancelledError:
+            result.cancelled = True
+        finally:
+            self.ledger.save()
+            if self._terminating and result.pending_ids:
+                self.pending_store.save({**job, "result": asdict(result)})
+            else:
+                self.pending_store.clear()
+        return result
+
+    async def _report(self, job: dict, result: BroadcastResult):
+        scope_text = "群聊" if job["is_group"] else "好友"
+        count = len(job["message_ids"])
+        msg_text = "此消息" if count == 1 else f"{count}条消息"
+
+        msg = f"已向{len(result.success_ids)}个{scope_text}广播{msg_text}"
+        if result.partial:
+            details = "、".join(f"{tid}({n}/{count})" for tid, n in result.partial.items())
+            msg += f"\n部分送达{len(result.partial)}个：{details}"
+        if result.failed_ids:
+            msg += f"\n发送失败{len(result.failed_ids)}个"
+        if result.pending_ids:
+            msg += f"\n未发送{len(result.pending_ids)}个"
+        await self._notify(job, msg)
+
+    def _start_job(self, client: CQHttp, job: dict, result: BroadcastResult):
+        task = asyncio.create_task(
+            self._run_job(client, job, result), name="broadcast_task"
+        )
+        self._broadcast_task = task
+
+        # 后台等待结果并汇报
+        async def _wait_result():
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                return
+            finally:
+                self._broadcast_task = None
+            if not self._terminating:
+                await self._report(job, result)
+
+        asyncio.create_task(_wait_result())
+
+    async def initialize(self):
+        """建立多实例协调，并恢复因重启中断的顺延广播任务"""
+        if self.cfg.coord_db_path:
+            try:
+                self.coord = await asyncio.to_thread(self._setup_coordinator)
+                await self._sync_disable()
+            except Exception as e:
+                logger.error(f"多实例协调初始化失败，按单实例运行: {e}")
+                self.coord = None
+
+        data = self.pending_store.load()
+        if not data:
+            return
+        try:
+            platform = self.context.get_platform(filter.PlatformAdapterType.AIOCQHTTP)
+            client = platform.get_client()
+            result = BroadcastResult(**data.pop("result"))
+        except Exception as e:
+            logger.error(f"恢复顺延广播任务失败: {e}")
+            return
+        result.cancelled = False
+        logger.info(f"恢复顺延广播任务，剩余{len(result.pending_ids)}个目标")
+        self._start_job(client, data, result)
 
     @filter.command("开启广播")
     async def enable_broadcast(
@@ -46,7 +285,9 @@ class BroadcastPlugin(Star):
         if not target_id:
             return
 
+        await self._sync_disable()
         self.cfg.enable_target(target_id, is_group=is_group)
+        await self._publish_disable(is_group, target_id, False)
         scope_name = "群聊" if is_group else "私聊"
         yield event.plain_result(f"【{name}】已开启{scope_name}广播")
 
@@ -72,7 +313,9 @@ class BroadcastPlugin(Star):
         if not target_id:
             return
 
+        await self._sync_disable()
         self.cfg.disable_target(target_id, is_group=is_group)
+        await self._publish_disable(is_group, target_id, True)
         yield event.plain_result(f"已关闭【{name}】的{scope_text}广播")
 
     @filter.permission_type(filter.PermissionType.ADMIN)
@@ -81,6 +324,7 @@ class BroadcastPlugin(Star):
         """广播列表 <留空|群聊|私聊>"""
         is_group = bool(parse_scope_name(scope_name))
         scope_text = "群聊" if is_group else "好友"
+        await self._sync_disable()
 
         enabled = []
         disabled = []
@@ -113,12 +357,35 @@ class BroadcastPlugin(Star):
 
         yield event.plain_result(msg)
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("加入广播")
+    async def add_to_batch(self, event: AiocqhttpMessageEvent):
+        """(引用消息)加入广播，将消息加入待广播批次"""
+        reply_id = get_reply_id(event)
+        if not reply_id:
+            yield event.plain_result("需要引用要加入广播的消息")
+            return
+
+        batch = self._pending_batches.setdefault(event.get_sender_id(), [])
+        batch.append(reply_id)
+        yield event.plain_result(f"已加入广播批次，当前共{len(batch)}条消息")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("清空广播")
+    async def clear_batch(self, event: AiocqhttpMessageEvent):
+        """清空待广播批次"""
+        self._pending_batches.pop(event.get_sender_id(), None)
+        yield event.plain_result("已清空广播批次")
+
     @filter.permission_type(filter.PermissionType.ADMIN)
     @filter.command("广播")
     async def cmd_broadcast(self, event: AiocqhttpMessageEvent, scope_name: str = ""):
         """(引用消息)广播 <群聊|私聊|全部>"""
+        message_ids = list(self._pending_batches.get(event.get_sender_id(), []))
         reply_id = get_reply_id(event)
-        if not reply_id:
+        if reply_id and reply_id not in message_ids:
+            message_ids.append(reply_id)
+        if not message_ids:
             yield event.plain_result("需要引用要广播的消息")
             return
 
@@ -128,48 +395,52 @@ class BroadcastPlugin(Star):
 
         is_group = bool(parse_scope_name(scope_name))
         scope_text = "群聊" if is_group else "好友"
+        msg_text = "此消息" if len(message_ids) == 1 else f"{len(message_ids)}条消息"
 
-        ids = await get_ids(client=event.bot, is_group=is_group)
+        quota_key = f"{event.get_self_id()}:{'group' if is_group else 'friend'}"
+        max_batch = self.ledger.max_batch(quota_key)
+        if len(message_ids) > max_batch:
+            yield event.plain_result(
+                f"批次共{len(message_ids)}条消息，超过单个{scope_text}的发送配额上限{max_batch}条"
+            )
+            return
 
-        if self.cfg.skip_source:
-            source_id = str(event.get_group_id() if is_group else event.get_sender_id())
-            if source_id in ids:
-                ids.remove(source_id)
+        if self.coord and not await asyncio.to_thread(self.coord.acquire_lease):
+            yield event.plain_result("其他实例正在广播中")
+            return
 
-        filter_ids = self.cfg.filter_broadcastable(ids, is_group=is_group)
+        # 租约已获取但任务尚未接管时出错，需立即释放，避免其他实例被锁到租约过期
+        try:
+            ids = await get_ids(client=event.bot, is_group=is_group)
 
-        task = asyncio.create_task(
-            broadcast(
-                client=event.bot,
-                is_group=is_group,
-                message_id=reply_id,
-                ids=filter_ids,
-                delay=self.cfg.get_broadcast_delay(),
-            ),
-            name="broadcast_task",
-        )
-        self._broadcast_task = task
+            if self.cfg.skip_source:
+                source_id = str(
+                    event.get_group_id() if is_group else event.get_sender_id()
+                )
+                if source_id in ids:
+                    ids.remove(source_id)
+
+            await self._sync_disable()
+            filter_ids = self.cfg.filter_broadcastable(ids, is_group=is_group)
+        except BaseException:
+            await self._release_lease()
+            raise
+
+        job = {
+            "message_ids": message_ids,
+            "is_group": is_group,
+            "quota_key": quota_key,
+            "umo": event.unified_msg_origin,
+        }
+        self._start_job(event.bot, job, BroadcastResult(pending_ids=filter_ids))
+        self._pending_batches.pop(event.get_sender_id(), None)
 
         chain = [
-            Reply(id=reply_id),
-            Plain(f"正在向{len(filter_ids)}个{scope_text}广播此消息..."),
+            Reply(id=message_ids[0]),
+            Plain(f"正在向{len(filter_ids)}个{scope_text}广播{msg_text}..."),
         ]
         yield event.chain_result(chain)
 
-        # 后台等待结果并汇报
-        async def _wait_result():
-            try:
-                success_ids = await task
-            except asyncio.CancelledError:
-                return
-            finally:
-                self._broadcast_task = None
-
-            msg = f"已向{len(success_ids)}个{scope_text}广播此消息"
-            await event.send(event.plain_result(msg))
-
-        asyncio.create_task(_wait_result())
-
     @filter.permission_type(filter.PermissionType.ADMIN)
     @filter.command("取消广播")
     async def cancel_broadcast(self, event: AiocqhttpMessageEvent):
@@ -182,3 +453,16 @@ class BroadcastPlugin(Star):
 
         task.cancel()
         yield event.plain_result("已请求取消广播")
+
+    async def terminate(self):
+        self._terminating = True
+        task = self._broadcast_task
+        if task and not task.done():
+            task.cancel()
+            # 等任务的 finally 释放租约后再关闭连接
+            with suppress(asyncio.CancelledError, Exception):
+                await task
+        self.ledger.save()
+        if self.coord:
+            await self._release_lease()
+            self.coord.close()
@@ -0,0 +1,189 @@
+import json
+import math
+import os
+import time
+from collections import deque
+
+from astrbot.core import logger
+
+# 上限为 0 时视为不限制
+UNLIMITED = 1 << 31
+
+
+class _Window:
+    """
+    滚动窗口计数器：窗口按固定粒度分桶，维护桶内计数与总和，
+    过期桶从左侧弹出，查询与记录均摊 O(1)
+    """
+
+    def __init__(self, span: int, bucket_seconds: int):
+        self.span = span
+        self.bucket_seconds = bucket_seconds
+        self.buckets: deque[list[int]] = deque()  # [bucket_id, count]
+        self.total = 0
+
+    def _expire(self, now: float) -> int:
+        current = int(now // self.bucket_seconds)
+        while self.buckets and self.buckets[0][0] <= current - self.span:
+            self.total -= self.buckets.popleft()[1]
+        return current
+
+    def count(self, now: float) -> int:
+        self._expire(now)
+        return self.total
+
+    def add(self, now: float, n: int) -> None:
+        current = self._expire(now)
+        if self.buckets and self.buckets[-1][0] == current:
+            self.buckets[-1][1] += n
+        else:
+            self.buckets.append([current, n])
+        self.total += n
+
+    def retry_after(self, now: float, amount: int) -> float:
+        """
+        从最早的桶开始依次过期，累计腾出 amount 条余量还需的秒数；
+        窗口内计数不足以腾出 amount 条时返回 inf
+        """
+        self._expire(now)
+        freed = 0
+        for bucket_id, count in self.buckets:
+            if freed >= amount:
+                break
+            freed += count
+            if freed >= amount:
+                expire_at = (bucket_id + self.span) * self.bucket_seconds
+                return max(expire_at - now, 0.0)
+        return 0.0 if amount <= 0 else math.inf
+
+    def dump(self) -> list[list[int]]:
+        return [list(b) for b in self.buckets]
+
+    def load(self, buckets: list[list[int]]) -> None:
+        self.buckets = deque([int(b[0]), int(b[1])] for b in buckets)
+        self.total = sum(b[1] for b in self.buckets)
+
+
+class QuotaLedger:
+    """
+    账号发送配额账本（按 账号:目标类型 记账，持久化到本地 JSON）
+
+    - 小时窗口：60 个 1 分钟桶
+    - 天窗口：24 个 1 小时桶
+    """
+
+    def __init__(self, path: str, caps: dict[str, tuple[int, int]]):
+        """caps: {target_type: (hourly_cap, daily_cap)}"""
+        self.path = path
+        self.caps = caps
+        self._hour: dict[str, _Window] = {}
+        self._day: dict[str, _Window] = {}
+        self._dirty = False
+        self._load()
+
+    def _windows(self, key: str) -> tuple[_Window, _Window]:
+        if key not in self._hour:
+            self._hour[key] = _Window(span=60, bucket_seconds=60)
+            self._day[key] = _Window(span=24, bucket_seconds=3600)
+        return self._hour[key], self._day[key]
+
+    def _caps(self, key: str) -> tuple[int, int]:
+        t = key.rsplit(":", 1)[-1]
+        return self.caps.get(t, (0, 0))
+
+    # =========================
+    # 查询 / 记账
+    # =========================
+
+    def remaining(self, key: str) -> int:
+        """当前窗口内还能发送的条数"""
+        now = time.time()
+        hour, day = self._windows(key)
+        hourly_cap, daily_cap = self._caps(key)
+        left = UNLIMITED
+        if hourly_cap > 0:
+            left = min(left, hourly_cap - hour.count(now))
+        if daily_cap > 0:
+            left = min(left, daily_cap - day.count(now))
+        return max(left, 0)
+
+    def max_batch(self, key: str) -> int:
+        """单个目标一次最多能发送的条数（最小的非零上限）"""
+        caps = [cap for cap in self._caps(key) if cap > 0]
+        return min(caps) if caps else UNLIMITED
+
+    def retry_after(self, key: str, need: int = 1) -> float:
+        """距离再次有 need 条余量还需的秒数；need 超过上限、永远无法满足时返回 inf"""
+        now = time.time()
+        hour, day = self._windows(key)
+        hourly_cap, daily_cap = self._caps(key)
+        wait = 0.0
+        if hourly_cap > 0:
+            wait = max(wait, hour.retry_after(now, hour.count(now) - hourly_cap + need))
+        if daily_cap > 0:
+            wait = max(wait, day.retry_after(now, day.count(now) - daily_cap + need))
+        return wait
+
+    def record(self, key: str, n: int = 1) -> None:
+        now = time.time()
+        hour, day = self._windows(key)
+        hour.add(now, n)
+        day.add(now, n)
+        self._dirty = True
+
+    # =========================
+    # 持久化
+    # =========================
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            for key, item in data.items():
+                hour, day = self._windows(key)
+                hour.load(item.get("hour", []))
+                day.load(item.get("day", []))
+        except Exception as e:
+            logger.error(f"读取配额账本失败: {e}")
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        data = {
+            key: {"hour": self._hour[key].dump(), "day": self._day[key].dump()}
+            for key in self._hour
+        }
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+
+class PendingJobStore:
+    """进行中（含因配额顺延）的广播任务，逐目标持久化到本地 JSON，重启后恢复"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> dict | None:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"读取顺延广播任务失败: {e}")
+            return None
+
+    def save(self, job: dict) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,4 +1,6 @@
 import asyncio
+from collections.abc import Callable
+from dataclasses import dataclass, field
 
 from aiocqhttp import CQHttp
 
@@ -8,6 +10,8 @@ from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
     AiocqhttpMessageEvent,
 )
 
+from .quota import QuotaLedger
+
 
 def parse_scope_name(
     scope_name: str = "",
@@ -119,36 +123,80 @@ async def get_ids(client: CQHttp, is_group: bool) -> list[str]:
         return [str(f["user_id"]) for f in friends]
 
 
+@dataclass(slots=True)
+class BroadcastResult:
+    success_ids: list[str] = field(default_factory=list)
+    # 批次只送达了一部分的目标 -> 已送达条数
+    partial: dict[str, int] = field(default_factory=dict)
+    failed_ids: list[str] = field(default_factory=list)
+    # 尚未处理的目标（每处理完一个目标即移除）
+    pending_ids: list[str] = field(default_factory=list)
+    cancelled: bool = False
+
+
 async def broadcast(
     client: CQHttp,
     *,
     is_group: bool,
-    message_id: str | int,
+    message_ids: list[str] | list[int],
     ids: list[str] | list[int],
     delay: float = 0.5,
-):
-    success_ids = []
+    ledger: QuotaLedger | None = None,
+    quota_key: str = "",
+    result: BroadcastResult | None = None,
+    on_progress: Callable[[BroadcastResult], None] | None = None,
+) -> BroadcastResult:
+    """
+    逐个目标广播一批消息：每个目标按顺序收完整批消息后再处理下一个目标，延迟只作用于目标之间。
+    某条消息失败时跳过该目标剩余消息，并记录已送达条数；配额不足以发完整批时提前停止。
+    传入 result 时在其上累计结果；每处理完一个目标调用 on_progress，便于调用方落盘
+    """
+    result = result or BroadcastResult()
+    ids = [str(t) for t in ids]
+    result.pending_ids = list(ids)
+    i = 0
     try:
-        for tid in ids:
+        for i, tid in enumerate(ids):
+            if ledger and ledger.remaining(quota_key) < len(message_ids):
+                logger.info(
+                    f"{quota_key} 发送配额不足，剩余{len(result.pending_ids)}个目标顺延"
+                )
+                break
             await asyncio.sleep(delay)
+            delivered = 0
             try:
-                if is_group:
-                    await client.forward_group_single_msg(
-                        group_id=int(tid),
-                        message_id=message_id,
-                    )
-                    success_ids.append(tid)
-                else:
-                    await client.forward_friend_single_msg(
-                        user_id=int(tid),
-                        message_id=message_id,
-                    )
-                    success_ids.append(tid)
+                for message_id in message_ids:
+                    if is_group:
+                        await client.forward_group_single_msg(
+                            group_id=int(tid),
+                            message_id=message_id,
+                        )
+                    else:
+                        await client.forward_friend_single_msg(
+                            user_id=int(tid),
+                            message_id=message_id,
+                        )
+                    delivered += 1
+                    if ledger:
+                        ledger.record(quota_key)
+                result.success_ids.append(tid)
             except asyncio.CancelledError:
-                return success_ids
+                if delivered:
+                    result.partial[tid] = delivered
+                    result.pending_ids = ids[i + 1 :]
+                result.cancelled = True
+                return result
             except Exception as e:
-                logger.warning(f"{tid} 广播失败: {e}")
-        return success_ids
+                if delivered:
+                    result.partial[tid] = delivered
+                else:
+                    result.failed_ids.append(tid)
+                logger.warning(f"{tid} 广播失败（已送达{delivered}条）: {e}")
+            result.pending_ids = ids[i + 1 :]
+            if on_progress:
+                on_progress(result)
+        return result
     except asyncio.CancelledError:
         logger.info("广播任务被取消")
-        return success_ids
+        result.cancelled = True
+        return result